@@ -15,11 +15,17 @@ TODO: For production, move secrets (client_id, client_secret, token_url)
 
 from __future__ import annotations
 
+import asyncio
+import atexit
 import os
+import threading
+import time
 from typing import Optional
 
 import httpx
 from models import Transaction, Wallet
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 TRANSFER_2FA_THRESHOLD = float(os.getenv("TRANSFER_2FA_THRESHOLD", "1000"))
@@ -34,6 +40,18 @@ BANK_API_TLS_CERT = os.getenv("BANK_API_TLS_CERT")
 BANK_API_TLS_KEY = os.getenv("BANK_API_TLS_KEY")
 BANK_API_TLS_CA = os.getenv("BANK_API_TLS_CA")
 
+_http_client: Optional[httpx.Client] = None
+_http_client_lock = threading.Lock()
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+# Refresh the OAuth2 token this many seconds before it actually expires.
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+# (token_url, client_id, scope) -> (token, expires_at); keyed by the
+# credentials so a token is never reused after they change. Entries are
+# replaced with a single (atomic) dict assignment, so no lock is needed:
+# at worst two concurrent refreshes both fetch a token and the last wins.
+_token_cache: dict = {}
+
 
 class InsufficientFundsError(Exception):
     pass
@@ -45,12 +63,10 @@ class DuplicateTransactionError(Exception):
 
 def get_balance(db: Session, user_id: str) -> float:
     if BANK_CLIENT_MODE == "http":
-        if not BANK_API_BASE_URL:
-            raise RuntimeError("BANK_API_BASE_URL not configured")
+        url = _api_url(f"/accounts/{user_id}/balance")
         token = _get_access_token()
-        url = f"{BANK_API_BASE_URL.rstrip('/')}/accounts/{user_id}/balance"
-        with _build_http_client() as client:
-            resp = client.get(url, headers={"Authorization": f"Bearer {token}"})
+        client = _get_http_client()
+        resp = client.get(url, headers={"Authorization": f"Bearer {token}"})
         resp.raise_for_status()
         data = resp.json()
         return float(data.get("balance", 0.0))
@@ -58,10 +74,9 @@ def get_balance(db: Session, user_id: str) -> float:
     wallet = db.query(Wallet).filter(Wallet.user_id == user_id).first()
     if not wallet:
         # create an empty wallet for demo
-        wallet = Wallet(user_id=user_id, balance=0.0)
-        db.add(wallet)
+        db.add(Wallet(user_id=user_id, balance=0.0))
         db.commit()
-        db.refresh(wallet)
+        return 0.0
     return float(wallet.balance or 0.0)
 
 
@@ -82,10 +97,8 @@ def perform_transfer(
     """
 
     if BANK_CLIENT_MODE == "http":
-        if not BANK_API_BASE_URL:
-            raise RuntimeError("BANK_API_BASE_URL not configured")
+        url = _api_url("/transfers")
         token = _get_access_token()
-        url = f"{BANK_API_BASE_URL.rstrip('/')}/transfers"
         payload = {
             "payer_user_id": payer_user_id,
             "amount": amount,
@@ -94,49 +107,38 @@ def perform_transfer(
             "concept": concept,
             "client_tx_id": client_tx_id,
         }
-        with _build_http_client() as client:
-            resp = client.post(
-                url,
-                headers={"Authorization": f"Bearer {token}"},
-                json=payload,
-            )
-        resp.raise_for_status()
-        data = resp.json()
-        # For simplicity we return a Transaction-like object using the
-        # response fields when in HTTP mode.
-        tx = Transaction(
-            id=data.get("id"),
-            payer_wallet_id=data.get("payer_wallet_id"),
-            payee_wallet_id=data.get("payee_wallet_id"),
-            amount=data.get("amount", amount),
-            currency=data.get("currency", currency),
-            concept=data.get("concept", concept),
-            status=data.get("status", "completed"),
-            client_tx_id=data.get("client_tx_id", client_tx_id),
-            destination_account=data.get("destination_account", destination_account),
+        client = _get_http_client()
+        resp = client.post(
+            url,
+            headers={"Authorization": f"Bearer {token}"},
+            json=payload,
         )
-        return tx
+        resp.raise_for_status()
+        return _transaction_from_response(resp.json(), payload)
 
     if client_tx_id:
-        existing = (
-            db.query(Transaction)
-            .filter(Transaction.client_tx_id == client_tx_id)
-            .first()
-        )
+        existing = _find_transaction(db, client_tx_id)
         if existing:
             return existing
 
-    wallet = db.query(Wallet).filter(Wallet.user_id == payer_user_id).first()
-    if not wallet:
-        raise InsufficientFundsError("wallet_not_found")
-
-    if (wallet.balance or 0.0) < amount:
+    # Check and debit the balance in one statement so concurrent transfers
+    # can't both pass the check and overdraw the wallet.
+    wallet_id = db.execute(
+        update(Wallet)
+        .where(Wallet.user_id == payer_user_id, Wallet.balance >= amount)
+        .values(balance=Wallet.balance - float(amount))
+        .returning(Wallet.id)
+    ).scalar_one_or_none()
+    if wallet_id is None:
+        wallet_exists = (
+            db.query(Wallet.id).filter(Wallet.user_id == payer_user_id).first()
+        )
+        if not wallet_exists:
+            raise InsufficientFundsError("wallet_not_found")
         raise InsufficientFundsError("insufficient_funds")
 
-    wallet.balance = float(wallet.balance) - float(amount)
-
     tx = Transaction(
-        payer_wallet_id=wallet.id,
+        payer_wallet_id=wallet_id,
         payee_wallet_id=None,
         amount=amount,
         currency=currency,
@@ -146,26 +148,204 @@ def perform_transfer(
         destination_account=destination_account,
     )
     db.add(tx)
-    db.commit()
-    db.refresh(tx)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent request with the same client_tx_id committed first
+        # (unique index); rolling back also undoes our debit.
+        db.rollback()
+        existing = _find_transaction(db, client_tx_id) if client_tx_id else None
+        if existing:
+            return existing
+        raise
     return tx
 
 
+def _find_transaction(db: Session, client_tx_id: str) -> Optional[Transaction]:
+    return (
+        db.query(Transaction)
+        .filter(Transaction.client_tx_id == client_tx_id)
+        .first()
+    )
+
+
+async def aget_balance(db: Session, user_id: str) -> float:
+    """Async variant of `get_balance` for callers on the event loop.
+
+    In "http" mode the bank API is awaited through the shared
+    AsyncClient; in "local" mode the SQLAlchemy version runs in a
+    worker thread so it doesn't block the loop.
+    """
+
+    if BANK_CLIENT_MODE != "http":
+        return await asyncio.to_thread(get_balance, db, user_id)
+
+    url = _api_url(f"/accounts/{user_id}/balance")
+    token = await _aget_access_token()
+    client = _get_async_http_client()
+    resp = await client.get(url, headers={"Authorization": f"Bearer {token}"})
+    resp.raise_for_status()
+    data = resp.json()
+    return float(data.get("balance", 0.0))
+
+
+async def aperform_transfer(
+    db: Session,
+    payer_user_id: str,
+    amount: float,
+    destination_account: str,
+    currency: str = "MXN",
+    concept: str = "Transferencia WhatsApp",
+    client_tx_id: Optional[str] = None,
+) -> Transaction:
+    """Async variant of `perform_transfer` (see `aget_balance`)."""
+
+    if BANK_CLIENT_MODE != "http":
+        return await asyncio.to_thread(
+            perform_transfer,
+            db,
+            payer_user_id=payer_user_id,
+            amount=amount,
+            destination_account=destination_account,
+            currency=currency,
+            concept=concept,
+            client_tx_id=client_tx_id,
+        )
+
+    url = _api_url("/transfers")
+    token = await _aget_access_token()
+    payload = {
+        "payer_user_id": payer_user_id,
+        "amount": amount,
+        "destination_account": destination_account,
+        "currency": currency,
+        "concept": concept,
+        "client_tx_id": client_tx_id,
+    }
+    client = _get_async_http_client()
+    resp = await client.post(
+        url,
+        headers={"Authorization": f"Bearer {token}"},
+        json=payload,
+    )
+    resp.raise_for_status()
+    return _transaction_from_response(resp.json(), payload)
+
+
 def is_2fa_required(amount: float) -> bool:
     return float(amount) >= TRANSFER_2FA_THRESHOLD
 
 
-def _build_http_client() -> httpx.Client:
+def _api_url(path: str) -> str:
+    if not BANK_API_BASE_URL:
+        raise RuntimeError("BANK_API_BASE_URL not configured")
+    return f"{BANK_API_BASE_URL.rstrip('/')}{path}"
+
+
+def _transaction_from_response(data: dict, payload: dict) -> Transaction:
+    # For simplicity we return a Transaction-like object using the
+    # response fields when in HTTP mode.
+    return Transaction(
+        id=data.get("id"),
+        payer_wallet_id=data.get("payer_wallet_id"),
+        payee_wallet_id=data.get("payee_wallet_id"),
+        amount=data.get("amount", payload["amount"]),
+        currency=data.get("currency", payload["currency"]),
+        concept=data.get("concept", payload["concept"]),
+        status=data.get("status", "completed"),
+        client_tx_id=data.get("client_tx_id", payload["client_tx_id"]),
+        destination_account=data.get(
+            "destination_account", payload["destination_account"]
+        ),
+    )
+
+
+def _http_client_options() -> dict:
     verify: bool | str = True
     if BANK_API_TLS_CA:
         verify = BANK_API_TLS_CA
     cert = None
     if BANK_API_TLS_CERT and BANK_API_TLS_KEY:
         cert = (BANK_API_TLS_CERT, BANK_API_TLS_KEY)
-    return httpx.Client(verify=verify, cert=cert, timeout=10.0)
+    return {
+        "verify": verify,
+        "cert": cert,
+        "timeout": 10.0,
+        "limits": httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    }
+
+
+def _build_http_client() -> httpx.Client:
+    return httpx.Client(**_http_client_options())
+
+
+def _get_http_client() -> httpx.Client:
+    """Return the shared bank API client, creating it on first use.
+
+    Reusing a single client keeps connections alive between calls so we
+    don't pay a new TCP/TLS handshake for every balance or transfer.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = _build_http_client()
+                atexit.register(_http_client.close)
+    return _http_client
+
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient used by the `a*` variants.
+
+    It is created lazily on the running event loop and closed by
+    `aclose_http_clients` when the app shuts down.
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(**_http_client_options())
+    return _async_http_client
+
+
+async def aclose_http_clients() -> None:
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
 
 
 def _get_access_token() -> str:
+    """Return a bank OAuth2 access token, reusing it until close to expiry."""
+    key = _token_cache_key()
+    token = _cached_access_token(key)
+    if token:
+        return token
+
+    resp = _get_http_client().post(**_token_request())
+    return _store_access_token(key, resp)
+
+
+async def _aget_access_token() -> str:
+    key = _token_cache_key()
+    token = _cached_access_token(key)
+    if token:
+        return token
+
+    resp = await _get_async_http_client().post(**_token_request())
+    return _store_access_token(key, resp)
+
+
+def _token_cache_key() -> tuple:
+    return (BANK_API_TOKEN_URL, BANK_API_CLIENT_ID, BANK_API_SCOPE)
+
+
+def _cached_access_token(key: tuple) -> Optional[str]:
+    token, expires_at = _token_cache.get(key, (None, 0.0))
+    if token and time.monotonic() < expires_at - TOKEN_EXPIRY_MARGIN_SECONDS:
+        return token
+    return None
+
+
+def _token_request() -> dict:
     if not (BANK_API_TOKEN_URL and BANK_API_CLIENT_ID and BANK_API_CLIENT_SECRET):
         raise RuntimeError("Bank OAuth2 client credentials not configured")
 
@@ -173,15 +353,21 @@ def _get_access_token() -> str:
     if BANK_API_SCOPE:
         data["scope"] = BANK_API_SCOPE
 
-    resp = httpx.post(
-        BANK_API_TOKEN_URL,
-        data=data,
-        auth=(BANK_API_CLIENT_ID, BANK_API_CLIENT_SECRET),
-        timeout=10.0,
-        verify=BANK_API_TLS_CA or True,
-    )
+    return {
+        "url": BANK_API_TOKEN_URL,
+        "data": data,
+        "auth": (BANK_API_CLIENT_ID, BANK_API_CLIENT_SECRET),
+    }
+
+
+def _store_access_token(key: tuple, resp: httpx.Response) -> str:
     resp.raise_for_status()
-    token = resp.json().get("access_token")
+    body = resp.json()
+    token = body.get("access_token")
     if not token:
         raise RuntimeError("No access_token in bank OAuth2 response")
+    _token_cache[key] = (
+        token,
+        time.monotonic() + int(body.get("expires_in") or 3600),
+    )
     return token
@@ -0,0 +1,29 @@
+"""Connection pool settings shared by main.py and init_db.py."""
+
+import os
+
+from sqlalchemy import make_url
+
+
+def is_memory_sqlite(database_url: str) -> bool:
+    url = make_url(database_url)
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+def pool_options(database_url: str) -> dict:
+    """QueuePool sizing for `create_engine`, from the DB_POOL_* env vars.
+
+    In-memory SQLite URLs get SingletonThreadPool, which rejects these
+    options, so they get none.
+    """
+    if is_memory_sqlite(database_url):
+        return {}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_recycle": 1800,
+        # seconds a request waits for a free pooled connection before failing
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
@@ -14,6 +14,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from db_pool import pool_options
 from models import Base, User, Wallet
 
 
@@ -23,7 +24,9 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL not set. Configure your .env file.")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(
+    DATABASE_URL, pool_pre_ping=True, **pool_options(DATABASE_URL)
+)
 SessionLocal = sessionmaker(bind=engine)
 
 
@@ -41,14 +44,14 @@ def init_db(seed_demo: bool = True) -> None:
         if not user:
             user = User(phone=phone, name="Demo User", verified=False)
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            # flush assigns user.id; committed together with the wallet
+            db.flush()
 
         wallet = db.query(Wallet).filter(Wallet.user_id == user.id).first()
         if not wallet:
             wallet = Wallet(user_id=user.id, balance=1000.0)
             db.add(wallet)
-            db.commit()
+        db.commit()
     finally:
         db.close()
 
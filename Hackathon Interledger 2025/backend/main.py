@@ -1,16 +1,28 @@
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
 import re
-from collections import defaultdict, deque
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from time import time
+from time import monotonic, time
 from typing import Optional
 
+import redis
+from arq import create_pool
+from arq.connections import ArqRedis, RedisSettings
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import case, create_engine, event, func, make_url, update
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 from twilio.twiml.messaging_response import MessagingResponse
 
 load_dotenv()
@@ -18,32 +30,221 @@ load_dotenv()
 import bank_client
 import nlu
 import utils
+from db_pool import is_memory_sqlite, pool_options
 from models import Base, LookupLog, PendingRequest, User, VerifyLog, Wallet
 from twilio_client import check_verification, create_verification_whatsapp, lookup_phone
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+
+_logging_configured = False
+
+
+def configure_logging() -> None:
+    """Log to stderr from a background thread.
+
+    Request and task code only enqueue records, so they never block on
+    the stream write. Called by the entry points (app start-up and the
+    arq worker) rather than on import, so importing main has no logging
+    side effects.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # the stream handler applies the full format on the listener thread
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+    # httpx logs every request URL at INFO, and bank URLs carry user ids
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine)
+_pool_options = pool_options(DATABASE_URL)
+# Opt-in for SQLite deployments: a single write connection (writers queue on
+# the pool instead of failing with SQLITE_BUSY) plus a pool of read-only
+# connections. WAL lets those readers run while the writer holds its lock.
+DB_SQLITE_SPLIT_POOLS = (
+    os.getenv("DB_SQLITE_SPLIT_POOLS", "0") == "1"
+    and make_url(DATABASE_URL).get_backend_name() == "sqlite"
+    and not is_memory_sqlite(DATABASE_URL)
+)
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    **(
+        {**_pool_options, "pool_size": 1, "max_overflow": 0}
+        if DB_SQLITE_SPLIT_POOLS
+        else _pool_options
+    ),
+)
+read_engine = None
+
+
+class RoutingSession(Session):
+    """Session that sends flushes and DML to `engine`, reads to `read_engine`.
+
+    Once a transaction has used the writer, its reads stay on the writer
+    until commit/rollback: it sees its own writes, and it never waits for
+    a reader while holding the only write connection (readers may all be
+    held by sessions waiting for that writer).
+    """
+
+    _on_writer = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._on_writer or self._flushing or (clause is not None and clause.is_dml):
+            self._on_writer = True
+            return engine
+        return read_engine
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _release_writer_routing(session, transaction):
+    if transaction.parent is None:
+        session._on_writer = False
+
+
+def _configure_sqlite_writer(write_engine) -> None:
+    """Put a SQLite write engine in WAL mode with BEGIN IMMEDIATE transactions."""
+
+    @event.listens_for(write_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        # Let SQLAlchemy emit BEGIN itself (see _begin_immediate).
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(write_engine, "begin")
+    def _begin_immediate(conn):
+        # Take the write lock up front: a deferred transaction that reads
+        # and then writes can fail with SQLITE_BUSY when upgrading its lock.
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+if DB_SQLITE_SPLIT_POOLS:
+    _configure_sqlite_writer(engine)
+
+    _db_url = make_url(DATABASE_URL)
+    read_engine = create_engine(
+        _db_url.set(
+            database=f"file:{_db_url.database}",
+            query={"mode": "ro", "uri": "true"},
+        ),
+        pool_pre_ping=True,
+        **{**_pool_options, "pool_size": os.cpu_count() or 4, "max_overflow": 0},
+    )
+
+# Objects stay loaded after commit: handlers return fields of rows they
+# just wrote (e.g. the transfer) without re-SELECTing them.
+SessionLocal = sessionmaker(
+    bind=engine,
+    class_=RoutingSession if DB_SQLITE_SPLIT_POOLS else Session,
+    expire_on_commit=False,
+)
 
-# create tables (simple approach)
-Base.metadata.create_all(bind=engine)
+# One session per HTTP request: the middleware below gives each request its
+# own scope and removes (closes) the session when the response is done.
+_request_scope: ContextVar[Optional[object]] = ContextVar("request_scope", default=None)
+ScopedSession = scoped_session(lambda: SessionLocal(), scopefunc=_request_scope.get)
+
+APP_AUTO_CREATE_TABLES = os.getenv("APP_AUTO_CREATE_TABLES", "1") == "1"
 
 OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
 OTP_LOCK_MINUTES = int(os.getenv("OTP_LOCK_MINUTES", "5"))
 RATE_LIMIT_WHATSAPP_PER_MINUTE = int(os.getenv("RATE_LIMIT_WHATSAPP_PER_MINUTE", "30"))
 RATE_LIMIT_VERIFY_PER_MINUTE = int(os.getenv("RATE_LIMIT_VERIFY_PER_MINUTE", "10"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+REDIS_URL = os.getenv("REDIS_URL")
+# "background": run follow-up work in FastAPI BackgroundTasks (same process).
+# "arq": enqueue it in Redis for `arq worker.WorkerSettings` processes.
+TASK_QUEUE = os.getenv("TASK_QUEUE", "background").lower()
+
+# Per-window counter shared by all workers: INCR the window's key and give
+# it a TTL on the first hit so old windows expire on their own.
+_RATE_LIMIT_LUA = """
+local n = redis.call('INCR', KEYS[1])
+if n == 1 then
+  redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return n
+"""
+_redis = (
+    redis.Redis(
+        connection_pool=redis.ConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=50,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    )
+    if REDIS_URL
+    else None
+)
+_rate_limit_script = _redis.register_script(_RATE_LIMIT_LUA) if _redis else None
 
-_rate_limit_store = defaultdict(deque)
+# In-process fallback when REDIS_URL is not set (per worker, LRU-bounded).
+# Sliding window counter: key -> (prev_count, curr_count, curr_window_id),
+# with window ids being int(monotonic() / window_seconds).
+_rate_limit_store = OrderedDict()
+_rate_limit_lock = threading.Lock()
+
+_arq_pool: Optional[ArqRedis] = None
+
+
+def get_db() -> Session:
+    return ScopedSession()
 
 
 def _check_rate_limit(key: str, limit: int, window_seconds: int = 60) -> None:
-    now = time()
-    dq = _rate_limit_store[key]
-    while dq and dq[0] <= now - window_seconds:
-        dq.popleft()
-    if len(dq) >= limit:
-        raise HTTPException(status_code=429, detail="rate_limit_exceeded")
-    dq.append(now)
+    if _rate_limit_script is not None:
+        window = int(time() // window_seconds)
+        try:
+            count = _rate_limit_script(
+                keys=[f"rl:{key}:{window}"], args=[window_seconds]
+            )
+        except redis.RedisError:
+            # Redis is down: keep limiting with the per-worker counters
+            # rather than failing the request.
+            logger.warning("Redis rate limit unavailable, using local fallback")
+        else:
+            if count > limit:
+                raise HTTPException(status_code=429, detail="rate_limit_exceeded")
+            return
+
+    position = monotonic() / window_seconds
+    window_id = int(position)
+    with _rate_limit_lock:
+        prev_count, curr_count, curr_id = _rate_limit_store.get(
+            key, (0, 0, window_id)
+        )
+        if window_id - curr_id >= 2:
+            prev_count, curr_count = 0, 0
+        elif window_id > curr_id:
+            prev_count, curr_count = curr_count, 0
+
+        # Weight the previous window by how much of it still overlaps the
+        # sliding window ending now.
+        estimated = prev_count * (1 - (position - window_id)) + curr_count
+        if estimated >= limit:
+            _rate_limit_store[key] = (prev_count, curr_count, window_id)
+            raise HTTPException(status_code=429, detail="rate_limit_exceeded")
+
+        _rate_limit_store[key] = (prev_count, curr_count + 1, window_id)
+        _rate_limit_store.move_to_end(key)
+        if len(_rate_limit_store) > RATE_LIMIT_MAX_KEYS:
+            _rate_limit_store.popitem(last=False)
 
 
 def _get_or_create_user_by_phone(db, phone_e164: str) -> User:
@@ -60,30 +261,114 @@ def _get_or_create_user_by_phone(db, phone_e164: str) -> User:
     return user
 
 
-def _ensure_user_not_locked(user: User) -> None:
-    if user.otp_locked_until and user.otp_locked_until > datetime.utcnow():
+def _ensure_user_not_locked(user: User, now: Optional[datetime] = None) -> None:
+    # Most users have no lock, so only read the clock when there is one.
+    if user.otp_locked_until and user.otp_locked_until > (now or datetime.utcnow()):
         raise HTTPException(status_code=423, detail="otp_locked")
 
 
-def _register_otp_result(db, user: User, status_val: Optional[str]) -> None:
+def _register_otp_result(
+    db, user: User, status_val: Optional[str], now: Optional[datetime] = None
+) -> Optional[User]:
+    """Record an OTP check outcome with a single UPDATE on the user row.
+
+    The failed-attempt counter and lock are computed by the database, so
+    we don't read-modify-write the row and concurrent checks can't lose
+    an increment. The new values come back via RETURNING and are set on
+    `user`, which is returned without another SELECT.
+    """
     if not user:
-        return
+        return None
     if status_val == "approved":
-        user.otp_failed_attempts = 0
-        user.otp_locked_until = None
-        user.verified = True
+        values = {"otp_failed_attempts": 0, "otp_locked_until": None, "verified": True}
     else:
-        current = user.otp_failed_attempts or 0
-        current += 1
-        user.otp_failed_attempts = current
-        if current >= OTP_MAX_ATTEMPTS:
-            user.otp_locked_until = datetime.utcnow() + timedelta(
-                minutes=OTP_LOCK_MINUTES
-            )
+        attempts = func.coalesce(User.otp_failed_attempts, 0) + 1
+        values = {
+            "otp_failed_attempts": attempts,
+            "otp_locked_until": case(
+                (
+                    attempts >= OTP_MAX_ATTEMPTS,
+                    (now or datetime.utcnow())
+                    + timedelta(minutes=OTP_LOCK_MINUTES),
+                ),
+                else_=User.otp_locked_until,
+            ),
+        }
+    row = db.execute(
+        update(User)
+        .where(User.id == user.id)
+        .values(**values)
+        .returning(User.otp_failed_attempts, User.otp_locked_until, User.verified)
+    ).one()
     db.commit()
+    for key, value in row._mapping.items():
+        set_committed_value(user, key, value)
+    return user
+
+
+def _verify_otp(db, phone_e164: str, code: str) -> Optional[str]:
+    """Check an OTP with Twilio Verify and record the attempt.
+
+    Shared by the WhatsApp CONFIRMAR reply and /api/v1/verify/check.
+    Returns the Verify status ("approved" on success).
+    """
+    now = datetime.utcnow()
+    user = _get_or_create_user_by_phone(db, phone_e164)
+    _ensure_user_not_locked(user, now)
+    chk = check_verification(phone_e164, code)
+    status_val = getattr(chk, "status", None)
+    vlog = VerifyLog(
+        user_id=None,
+        phone=phone_e164,
+        verify_sid=getattr(chk, "sid", None),
+        channel=getattr(chk, "channel", None) or "whatsapp",
+        status=status_val,
+        raw_response=chk.__dict__,
+        created_at=now,
+    )
+    # committed together with the OTP counters below
+    db.add(vlog)
+    _register_otp_result(db, user, status_val, now)
+    return status_val
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _arq_pool
+    configure_logging()
+    if APP_AUTO_CREATE_TABLES:
+        # create tables (simple approach); disable when using init_db.py
+        Base.metadata.create_all(bind=engine)
+    if TASK_QUEUE == "arq":
+        if not REDIS_URL:
+            raise RuntimeError("TASK_QUEUE=arq requires REDIS_URL")
+        _arq_pool = await create_pool(RedisSettings.from_dsn(REDIS_URL))
+    yield
+    await bank_client.aclose_http_clients()
+    if _arq_pool is not None:
+        await _arq_pool.aclose()
+        _arq_pool = None
+
+
+async def _enqueue_task(background_tasks: BackgroundTasks, func, *args) -> None:
+    """Run `func(*args)` after the response, in an arq worker if configured."""
+    if _arq_pool is not None:
+        await _arq_pool.enqueue_job(func.__name__, *args)
+    else:
+        background_tasks.add_task(func, *args)
 
 
-app = FastAPI(title="Wallet WhatsApp Verify Minimal")
+app = FastAPI(title="Wallet WhatsApp Verify Minimal", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def db_session_scope(request: Request, call_next):
+    token = _request_scope.set(object())
+    try:
+        return await call_next(request)
+    finally:
+        ScopedSession.remove()
+        _request_scope.reset(token)
 
 
 class VerifySendRequest(BaseModel):
@@ -116,7 +401,11 @@ def send_whatsapp_response(text: str):
 
 
 @app.post("/webhook/whatsapp")
-async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
+async def whatsapp_webhook(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
     # validate Twilio signature for security
     await utils.validate_twilio_request(request)
     form = await request.form()
@@ -134,59 +423,31 @@ async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
             "Número inválido. Asegúrate de usar tu número registrado."
         )
 
-    db = SessionLocal()
-
     # Rate limit per phone number for inbound webhook
-    if raw_phone:
-        try:
-            phone_for_rl = utils.to_e164(raw_phone, region="MX")
-            _check_rate_limit(f"wa:{phone_for_rl}", RATE_LIMIT_WHATSAPP_PER_MINUTE)
-        except Exception:
-            pass
+    await run_in_threadpool(
+        _check_rate_limit, f"wa:{phone_e164}", RATE_LIMIT_WHATSAPP_PER_MINUTE
+    )
 
     # If the user is replying CONFIRMAR <code>
     m = re.match(r"^\s*confirmar\s+(\d{4,8})\s*$", body, re.I)
     if m:
         code = m.group(1)
         try:
-            user = _get_or_create_user_by_phone(db, phone_e164)
-            _ensure_user_not_locked(user)
-            chk = check_verification(phone_e164, code)
+            status_val = await run_in_threadpool(_verify_otp, db, phone_e164, code)
         except Exception:
             return send_whatsapp_response(
                 "Error verificando código. Intenta nuevamente."
             )
-        vlog = VerifyLog(
-            user_id=None,
-            phone=phone_e164,
-            verify_sid=getattr(chk, "sid", None),
-            channel=getattr(chk, "channel", None),
-            status=getattr(chk, "status", None),
-            raw_response=chk.__dict__,
-        )
-        db.add(vlog)
-        db.commit()
-
-        status_val = getattr(chk, "status", None)
-        _register_otp_result(db, user, status_val)
 
         if status_val == "approved":
-            pr = (
-                db.query(PendingRequest)
-                .filter(
-                    PendingRequest.phone == phone_e164,
-                    PendingRequest.status == "pending",
-                )
-                .order_by(PendingRequest.created_at.asc())
-                .first()
+            pending_id = await run_in_threadpool(
+                _approve_oldest_pending_request, db, phone_e164
             )
-            if not pr:
+            if not pending_id:
                 return send_whatsapp_response(
                     "Verificación OK, pero no encontré ninguna solicitud pendiente."
                 )
-            pr.status = "approved"
-            db.commit()
-            background_tasks.add_task(execute_pending_request, pr.id)
+            await _enqueue_task(background_tasks, execute_pending_request, pending_id)
             return send_whatsapp_response(
                 "Código correcto ✅. Ejecutando tu solicitud. Te aviso cuando termine."
             )
@@ -195,6 +456,36 @@ async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
                 "Código incorrecto o expirado. Pide uno nuevo escribiendo: INICIAR"
             )
     # else: new request
+    user_id, pending_id = await run_in_threadpool(
+        _create_pending_request, db, phone_e164, body
+    )
+    # background lookup + verify
+    await _enqueue_task(
+        background_tasks, process_lookup_and_verify, phone_e164, user_id, pending_id
+    )
+    return send_whatsapp_response(
+        "Recibí tu mensaje. Para proteger tu cuenta, te envié un código por WhatsApp. Responde: CONFIRMAR <código>"
+    )
+
+
+def _approve_oldest_pending_request(db, phone_e164: str) -> Optional[str]:
+    pr = (
+        db.query(PendingRequest)
+        .filter(
+            PendingRequest.phone == phone_e164,
+            PendingRequest.status == "pending",
+        )
+        .order_by(PendingRequest.created_at.asc())
+        .first()
+    )
+    if not pr:
+        return None
+    pr.status = "approved"
+    db.commit()
+    return pr.id
+
+
+def _create_pending_request(db, phone_e164: str, body: str) -> tuple:
     user = _get_or_create_user_by_phone(db, phone_e164)
     pr = PendingRequest(
         user_id=user.id,
@@ -205,11 +496,7 @@ async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
     )
     db.add(pr)
     db.commit()
-    # background lookup + verify
-    background_tasks.add_task(process_lookup_and_verify, phone_e164, user.id, pr.id)
-    return send_whatsapp_response(
-        "Recibí tu mensaje. Para proteger tu cuenta, te envié un código por WhatsApp. Responde: CONFIRMAR <código>"
-    )
+    return user.id, pr.id
 
 
 def process_lookup_and_verify(phone, user_id, pending_id):
@@ -220,26 +507,16 @@ def process_lookup_and_verify(phone, user_id, pending_id):
             raw = lookup.__dict__
             line_type = getattr(lookup, "line_type_intelligence", None)
         except Exception as e:
-            l = LookupLog(
-                user_id=user_id,
-                phone=phone,
-                line_type=None,
-                raw_response={"error": str(e)},
-                created_at=datetime.utcnow(),
-            )
-            db.add(l)
-            db.commit()
+            raw = {"error": str(e)}
             line_type = None
-        else:
-            l = LookupLog(
-                user_id=user_id,
-                phone=phone,
-                line_type=line_type,
-                raw_response=raw,
-                created_at=datetime.utcnow(),
-            )
-            db.add(l)
-            db.commit()
+        lookup_log = LookupLog(
+            user_id=user_id,
+            phone=phone,
+            line_type=line_type,
+            raw_response=raw,
+            created_at=datetime.utcnow(),
+        )
+
         try:
             v = create_verification_whatsapp(phone)
             vlog = VerifyLog(
@@ -251,8 +528,6 @@ def process_lookup_and_verify(phone, user_id, pending_id):
                 raw_response={"sid": v.sid},
                 created_at=datetime.utcnow(),
             )
-            db.add(vlog)
-            db.commit()
         except Exception as e:
             vlog = VerifyLog(
                 user_id=user_id,
@@ -263,8 +538,10 @@ def process_lookup_and_verify(phone, user_id, pending_id):
                 raw_response={"error": str(e)},
                 created_at=datetime.utcnow(),
             )
-            db.add(vlog)
-            db.commit()
+
+        # Write both logs in a single transaction.
+        db.add_all([lookup_log, vlog])
+        db.commit()
     finally:
         db.close()
 
@@ -316,21 +593,25 @@ def execute_pending_request(pending_id):
             result_text = "No entendí la solicitud. Ejemplos: 'Saldo' o 'Enviar 100 a 012345678901234567'."
         pr.status = "executed"
         db.commit()
-        print("Execution result for", pending_id, result_text)
+        logger.info(
+            "Execution result for %s: %s",
+            pending_id,
+            result_text,
+            extra={"pending_id": pending_id, "result": result_text},
+        )
     finally:
         db.close()
 
 
 @app.post("/api/v1/verify/send")
-async def api_verify_send(payload: VerifySendRequest):
+def api_verify_send(payload: VerifySendRequest, db: Session = Depends(get_db)):
     try:
         phone_e164 = utils.to_e164(payload.phone, region="MX")
     except Exception:
         raise HTTPException(status_code=400, detail="invalid_phone_number")
 
-    db = SessionLocal()
+    _check_rate_limit(f"verify_send:{phone_e164}", RATE_LIMIT_VERIFY_PER_MINUTE)
     try:
-        _check_rate_limit(f"verify_send:{phone_e164}", RATE_LIMIT_VERIFY_PER_MINUTE)
         v = create_verification_whatsapp(phone_e164)
         vlog = VerifyLog(
             user_id=None,
@@ -346,86 +627,60 @@ async def api_verify_send(payload: VerifySendRequest):
         return {"status": "pending", "sid": v.sid}
     except Exception:
         raise HTTPException(status_code=400, detail="verification_send_failed")
-    finally:
-        db.close()
 
 
 @app.post("/api/v1/verify/check")
-async def api_verify_check(payload: VerifyCheckRequest):
+def api_verify_check(
+    payload: VerifyCheckRequest, db: Session = Depends(get_db)
+):
     try:
         phone_e164 = utils.to_e164(payload.phone, region="MX")
     except Exception:
         raise HTTPException(status_code=400, detail="invalid_phone_number")
 
-    db = SessionLocal()
+    _check_rate_limit(f"verify_check:{phone_e164}", RATE_LIMIT_VERIFY_PER_MINUTE)
     try:
-        _check_rate_limit(f"verify_check:{phone_e164}", RATE_LIMIT_VERIFY_PER_MINUTE)
-        user = _get_or_create_user_by_phone(db, phone_e164)
-        _ensure_user_not_locked(user)
-        chk = check_verification(phone_e164, payload.code)
-        status_val = getattr(chk, "status", None)
-        vlog = VerifyLog(
-            user_id=None,
-            phone=phone_e164,
-            verify_sid=getattr(chk, "sid", None),
-            channel=getattr(chk, "channel", None) or "whatsapp",
-            status=status_val,
-            raw_response=chk.__dict__,
-            created_at=datetime.utcnow(),
-        )
-        db.add(vlog)
-        db.commit()
-
-        _register_otp_result(db, user, status_val)
-
+        status_val = _verify_otp(db, phone_e164, payload.code)
         if status_val == "approved":
             return {"status": status_val, "approved": True}
         else:
             return {"status": status_val, "approved": False}
     except Exception:
         raise HTTPException(status_code=400, detail="verification_check_failed")
-    finally:
-        db.close()
 
 
 @app.post("/api/v1/nlu/parse")
-async def api_nlu_parse(payload: NLUParseRequest):
+def api_nlu_parse(payload: NLUParseRequest):
     return nlu.parse_text(payload.text)
 
 
 @app.get("/api/v1/accounts/{user_id}/balance")
-async def api_get_balance(user_id: str):
-    db = SessionLocal()
-    try:
-        balance = bank_client.get_balance(db, user_id)
-        return {"user_id": user_id, "balance": balance, "currency": "MXN"}
-    finally:
-        db.close()
+async def api_get_balance(user_id: str, db: Session = Depends(get_db)):
+    balance = await bank_client.aget_balance(db, user_id)
+    return {"user_id": user_id, "balance": balance, "currency": "MXN"}
 
 
 @app.post("/api/v1/transfers")
-async def api_create_transfer(payload: TransferRequest):
-    db = SessionLocal()
+async def api_create_transfer(
+    payload: TransferRequest, db: Session = Depends(get_db)
+):
+    requires_2fa = bank_client.is_2fa_required(payload.amount)
     try:
-        requires_2fa = bank_client.is_2fa_required(payload.amount)
-        try:
-            tx = bank_client.perform_transfer(
-                db,
-                payer_user_id=payload.user_id,
-                amount=payload.amount,
-                destination_account=payload.destination_account,
-                currency=payload.currency or "MXN",
-                concept=payload.concept or "Transferencia WhatsApp",
-                client_tx_id=payload.client_tx_id,
-            )
-        except bank_client.InsufficientFundsError:
-            raise HTTPException(status_code=400, detail="insufficient_funds")
-        return {
-            "id": tx.id,
-            "status": tx.status,
-            "requires_2fa": requires_2fa,
-            "amount": tx.amount,
-            "currency": tx.currency,
-        }
-    finally:
-        db.close()
+        tx = await bank_client.aperform_transfer(
+            db,
+            payer_user_id=payload.user_id,
+            amount=payload.amount,
+            destination_account=payload.destination_account,
+            currency=payload.currency or "MXN",
+            concept=payload.concept or "Transferencia WhatsApp",
+            client_tx_id=payload.client_tx_id,
+        )
+    except bank_client.InsufficientFundsError:
+        raise HTTPException(status_code=400, detail="insufficient_funds")
+    return {
+        "id": tx.id,
+        "status": tx.status,
+        "requires_2fa": requires_2fa,
+        "amount": tx.amount,
+        "currency": tx.currency,
+    }
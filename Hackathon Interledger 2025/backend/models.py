@@ -8,6 +8,7 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -40,7 +41,7 @@ class Wallet(Base):
     __tablename__ = "wallets"
     id = Column(String, primary_key=True, default=gen_uuid)
     interledger_wallet_id = Column(String, unique=True, nullable=True)
-    user_id = Column(String, ForeignKey("users.id"))
+    user_id = Column(String, ForeignKey("users.id"), unique=True, index=True)
     balance = Column(Float, default=0.0)
     clabe = Column(String, nullable=True)
     pin_hash = Column(String, nullable=True)
@@ -61,7 +62,7 @@ class Transaction(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="pending")
     preferred_method = Column(String, nullable=True)
-    client_tx_id = Column(String, nullable=True, index=True)
+    client_tx_id = Column(String, nullable=True, unique=True, index=True)
     destination_account = Column(String, nullable=True)
 
 
@@ -91,9 +92,19 @@ class VerifyLog(Base):
 
 class PendingRequest(Base):
     __tablename__ = "pending_requests"
+    # Serves the webhook's "oldest pending request for this phone" lookup;
+    # also covers lookups by phone alone.
+    __table_args__ = (
+        Index(
+            "ix_pending_requests_phone_status_created_at",
+            "phone",
+            "status",
+            "created_at",
+        ),
+    )
     id = Column(String, primary_key=True, default=gen_uuid)
     user_id = Column(String, ForeignKey("users.id"), nullable=True)
-    phone = Column(String, index=True)
+    phone = Column(String)
     message_text = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="pending")  # pending, approved, executed, cancelled
@@ -10,24 +10,63 @@ Later this can be extended to call external NLU engines (OpenAI
 compatible APIs or a Rasa server) based on configuration.
 """
 
-import json
+import copy
 import os
 import re
-from typing import Any, Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
 
 import httpx
+import orjson
 
 INTENT_CONSULTAR_SALDO = "consultar_saldo"
 INTENT_TRANSFERIR = "transferir"
 INTENT_DESCONOCIDO = "desconocido"
 
 NLU_PROVIDER = os.getenv("NLU_PROVIDER", "rule").lower()
+NLU_CACHE_SIZE = int(os.getenv("NLU_CACHE_SIZE", "4096"))
+NLU_CACHE_TTL_SECONDS = float(os.getenv("NLU_CACHE_TTL_SECONDS", "3600"))
+
+# (provider, normalized text) -> (expires_at, result). Only used for the
+# remote providers; the rule parser is cheaper than a cache hit.
+_parse_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+# Keywords per intent, matched in a single pass by one alternation
+# (named groups are the intent names). Balance wins over transfer when
+# a message contains both.
+_INTENT_KEYWORDS = {
+    INTENT_CONSULTAR_SALDO: ("saldo", "balance"),
+    INTENT_TRANSFERIR: ("transferir", "enviar", "pagar"),
+}
+_INTENT_KEYWORD_RE = re.compile(
+    "|".join(
+        f"(?P<{intent}>{'|'.join(keywords)})"
+        for intent, keywords in _INTENT_KEYWORDS.items()
+    )
+)
+# Amount and (simplistic) CLABE / account number detection in one scan over
+# whole number runs, each classified by its shape: 14-20 plain digits is the
+# account, longer plain runs are rejected (never split into account + amount).
+_NUMBER_RUN_RE = re.compile(r"\d+(?:[.,]\d+)*")
+_AMOUNT_RE = re.compile(r"\d+(?:[.,]\d{1,2})?")
 
 
 def _normalize(text: str) -> str:
     return (text or "").strip().lower()
 
 
+def _match_keyword_intent(t: str) -> Optional[str]:
+    intent = None
+    for m in _INTENT_KEYWORD_RE.finditer(t):
+        if m.lastgroup == INTENT_CONSULTAR_SALDO:
+            return INTENT_CONSULTAR_SALDO
+        intent = m.lastgroup
+    return intent
+
+
 def _parse_rule(text: str) -> Dict[str, Any]:
     """Rule-based parser for common intents.
 
@@ -41,9 +80,10 @@ def _parse_rule(text: str) -> Dict[str, Any]:
 
     original = text or ""
     t = _normalize(original)
+    intent = _match_keyword_intent(t)
 
     # Detect consultar saldo
-    if any(kw in t for kw in ["saldo", "balance"]):
+    if intent == INTENT_CONSULTAR_SALDO:
         return {
             "intent": {"name": INTENT_CONSULTAR_SALDO, "confidence": 0.95},
             "entities": {},
@@ -51,28 +91,17 @@ def _parse_rule(text: str) -> Dict[str, Any]:
         }
 
     # Detect transfer intent with amount + destination
-    if any(kw in t for kw in ["transferir", "enviar", "pagar"]):
-        amount = None
-        dest = None
-
-        m_amount = re.search(r"(\d+[\.,]\d{1,2}|\d+)", t)
-        if m_amount:
-            amount_str = m_amount.group(1).replace(",", ".")
-            try:
-                amount = float(amount_str)
-            except ValueError:
-                amount = None
-
-        # simplistic detection of CLABE or account number
-        m_dest = re.search(r"(\d{14,20})", t)
-        if m_dest:
-            dest = m_dest.group(1)
-
+    if intent == INTENT_TRANSFERIR:
         entities = {}
-        if amount is not None:
-            entities["amount"] = amount
-        if dest is not None:
-            entities["destination_account"] = dest
+        for m in _NUMBER_RUN_RE.finditer(t):
+            run = m.group()
+            if run.isdigit() and len(run) >= 14:
+                if len(run) <= 20:
+                    entities.setdefault("destination_account", run)
+            elif _AMOUNT_RE.fullmatch(run):
+                entities.setdefault("amount", float(run.replace(",", ".")))
+            if len(entities) == 2:
+                break
 
         return {
             "intent": {"name": INTENT_TRANSFERIR, "confidence": 0.9},
@@ -130,18 +159,18 @@ def _parse_openai(text: str) -> Dict[str, Any]:
         "Content-Type": "application/json",
     }
 
-    resp = httpx.post(url, headers=headers, json=payload, timeout=10.0)
+    resp = httpx.post(url, headers=headers, content=orjson.dumps(payload), timeout=10.0)
     resp.raise_for_status()
-    data = resp.json()
+    data = orjson.loads(resp.content)
     choices = data.get("choices") or []
     if not choices:
         raise RuntimeError("no choices in OpenAI-compatible response")
     content = choices[0].get("message", {}).get("content") or ""
     try:
-        parsed = json.loads(content)
-    except Exception:
-        # If the model did not return pure JSON, fall back to rule-based.
-        return _parse_rule(text)
+        parsed = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        # Let parse_text fall back (and skip caching) like any other failure.
+        raise RuntimeError("OpenAI-compatible response is not JSON")
 
     if "text" not in parsed:
         parsed["text"] = text
@@ -156,9 +185,14 @@ def _parse_rasa(text: str) -> Dict[str, Any]:
     """
 
     rasa_url = os.getenv("NLU_RASA_URL", "http://localhost:5005/model/parse")
-    resp = httpx.post(rasa_url, json={"text": text or ""}, timeout=5.0)
+    resp = httpx.post(
+        rasa_url,
+        headers={"Content-Type": "application/json"},
+        content=orjson.dumps({"text": text or ""}),
+        timeout=5.0,
+    )
     resp.raise_for_status()
-    data = resp.json()
+    data = orjson.loads(resp.content)
 
     intent = data.get("intent") or {}
     name = intent.get("name") or INTENT_DESCONOCIDO
@@ -186,25 +220,59 @@ def parse_text(text: str) -> Dict[str, Any]:
     - "rule"   (default): always use the internal rule-based parser.
     - "openai": try OpenAI-compatible API, then fall back to Rasa, then rule.
     - "rasa"  : try Rasa, then fall back to rule.
+
+    Successful OpenAI/Rasa results are cached per normalized text for
+    NLU_CACHE_TTL_SECONDS (at most NLU_CACHE_SIZE entries).
     """
 
     provider = NLU_PROVIDER
+    if provider not in ("openai", "rasa"):
+        # default: rule-based
+        return _parse_rule(text)
+
+    key = (provider, _normalize(text))
+    cached = _get_cached_parse(key)
+    if cached is not None:
+        cached["text"] = text or ""
+        return cached
 
     if provider == "openai":
         try:
-            return _parse_openai(text)
+            result = _parse_openai(text)
         except Exception:
             # Fallback chain: Rasa -> rule
             try:
                 return _parse_rasa(text)
             except Exception:
                 return _parse_rule(text)
-
-    if provider == "rasa":
+    else:
         try:
-            return _parse_rasa(text)
+            result = _parse_rasa(text)
         except Exception:
             return _parse_rule(text)
 
-    # default: rule-based
-    return _parse_rule(text)
+    # Fallback results are not cached so the provider is retried next time.
+    _store_cached_parse(key, result)
+    return result
+
+
+def _get_cached_parse(key: tuple) -> Optional[Dict[str, Any]]:
+    with _parse_cache_lock:
+        entry = _parse_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del _parse_cache[key]
+            return None
+        _parse_cache.move_to_end(key)
+    return copy.deepcopy(result)
+
+
+def _store_cached_parse(key: tuple, result: Dict[str, Any]) -> None:
+    entry = (time.monotonic() + NLU_CACHE_TTL_SECONDS, copy.deepcopy(result))
+    with _parse_cache_lock:
+        _parse_cache[key] = entry
+        _parse_cache.move_to_end(key)
+        while len(_parse_cache) > NLU_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
@@ -0,0 +1,69 @@
+import bank_client
+import main
+import pytest
+from fastapi.testclient import TestClient
+from models import Base
+from sqlalchemy import create_engine
+from sqlalchemy.orm import close_all_sessions, sessionmaker
+from tests.db import SessionLocal, clear_tables
+from tests.fakes import DummyAsyncClient, DummyClient
+
+
+@pytest.fixture
+def db():
+    """Session on the shared in-memory unit-test database."""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture(autouse=True)
+def _clean_in_memory_db():
+    yield
+    # Roll back whatever the test left open on the shared connection.
+    close_all_sessions()
+    clear_tables()
+
+
+@pytest.fixture(scope="session")
+def app_db():
+    """Point main at the API test database; yields its sessionmaker.
+
+    main must be rewired before the app's start-up runs create_all.
+    """
+    engine = create_engine(
+        "sqlite:///./test_api.db", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    app_session_local = sessionmaker(bind=engine)
+    main.engine = engine
+    main.SessionLocal = app_session_local
+    yield app_session_local
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def app_client(app_db):
+    # one app start-up for the whole run; server errors come back as 500s
+    with TestClient(main.app, raise_server_exceptions=False) as c:
+        yield c
+
+
+@pytest.fixture
+def http_mode_bank(monkeypatch):
+    """Point bank_client at a fake bank API with a fixed access token."""
+
+    async def fake_async_token():
+        return "fake-token"
+
+    monkeypatch.setattr(bank_client, "BANK_CLIENT_MODE", "http")
+    monkeypatch.setattr(bank_client, "BANK_API_BASE_URL", "https://bank.example.com")
+    monkeypatch.setattr(bank_client, "_get_access_token", lambda: "fake-token")
+    monkeypatch.setattr(bank_client, "_aget_access_token", fake_async_token)
+    monkeypatch.setattr(bank_client, "_get_http_client", lambda: DummyClient())
+    monkeypatch.setattr(
+        bank_client, "_get_async_http_client", lambda: DummyAsyncClient()
+    )
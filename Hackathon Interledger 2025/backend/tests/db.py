@@ -0,0 +1,47 @@
+"""Shared in-memory SQLite database for the unit tests.
+
+Creating a fresh engine and running the DDL for every test dominated the
+suite's wall time, so all tests share one in-memory database whose schema
+is created once; `tests/conftest.py` empties the tables between tests.
+
+API tests run the app against a separate file database (the `app_db`
+fixture in `tests/conftest.py`).
+"""
+
+from models import Base
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# StaticPool hands out the same connection on every checkout, so every
+# session sees the one in-memory database (and it stays alive).
+_ENGINE = create_engine(
+    "sqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+
+
+@event.listens_for(_ENGINE, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # SQLite keeps in-memory databases in "memory" journal mode, so the WAL
+    # request is a no-op here but matches the file-backed setup.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+Base.metadata.create_all(bind=_ENGINE)
+
+SessionLocal = sessionmaker(bind=_ENGINE)
+
+
+def clear_tables():
+    with _ENGINE.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
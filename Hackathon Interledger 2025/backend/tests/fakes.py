@@ -0,0 +1,63 @@
+"""Fake bank API clients for the HTTP-mode bank_client tests."""
+
+import bank_client
+
+_TX_TEMPLATE = {
+    "id": "tx-http-1",
+    "payer_wallet_id": "wallet-1",
+    "payee_wallet_id": None,
+    "amount": 0.0,
+    "currency": "MXN",
+    "concept": "Transferencia WhatsApp",
+    "status": "completed",
+    "client_tx_id": None,
+    "destination_account": None,
+}
+# Fields the fake bank echoes back from the transfer payload.
+_TX_PAYLOAD_FIELDS = (
+    "amount",
+    "currency",
+    "concept",
+    "client_tx_id",
+    "destination_account",
+)
+
+
+class DummyResponse:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError("HTTP error in dummy response")
+
+    def json(self):
+        return self._data
+
+
+class DummyClient:
+    def __init__(self):
+        self.token_requests = 0
+
+    def get(self, url, headers=None):
+        return DummyResponse({"balance": 123.45})
+
+    def post(self, url, headers=None, json=None, data=None, auth=None):
+        if url == bank_client.BANK_API_TOKEN_URL:
+            self.token_requests += 1
+            return DummyResponse({"access_token": "token-1", "expires_in": 300})
+        data = _TX_TEMPLATE.copy()
+        if json:
+            data.update((k, json[k]) for k in _TX_PAYLOAD_FIELDS if k in json)
+        return DummyResponse(data)
+
+
+class DummyAsyncClient(DummyClient):
+    async def get(self, url, headers=None):
+        return DummyClient.get(self, url, headers=headers)
+
+    async def post(self, url, headers=None, json=None, data=None, auth=None):
+        return DummyClient.post(
+            self, url, headers=headers, json=json, data=data, auth=auth
+        )
@@ -1,51 +1,33 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import bank_client
 import main
-from fastapi.testclient import TestClient
+import pytest
 from models import Base, User, Wallet
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-
-def setup_sqlite_db():
-    engine = create_engine(
-        "sqlite:///./test_api.db", connect_args={"check_same_thread": False}
-    )
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
-    SessionLocal = sessionmaker(bind=engine)
-    # Re-wire main's engine/session for tests
-    main.engine = engine
-    main.SessionLocal = SessionLocal
-    return SessionLocal
-
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import Session, sessionmaker
 
-def get_client():
-    setup_sqlite_db()
-    client = TestClient(main.app)
-    return client
 
-
-def test_nlu_parse_endpoint():
-    client = get_client()
-    resp = client.post("/api/v1/nlu/parse", json={"text": "Consultar saldo"})
+def test_nlu_parse_endpoint(app_client):
+    resp = app_client.post("/api/v1/nlu/parse", json={"text": "Consultar saldo"})
     assert resp.status_code == 200
     data = resp.json()
     assert data["intent"]["name"] == "consultar_saldo"
 
 
-def test_balance_endpoint():
-    client = get_client()
+def test_balance_endpoint(app_client):
     # para este endpoint no es necesario que exista el usuario de antemano
     user_id = "user-test-balance"
-    resp = client.get(f"/api/v1/accounts/{user_id}/balance")
+    resp = app_client.get(f"/api/v1/accounts/{user_id}/balance")
     assert resp.status_code == 200
     data = resp.json()
     assert data["user_id"] == user_id
     assert data["currency"] == "MXN"
 
 
-def test_transfer_endpoint_creates_transaction():
-    SessionLocal = setup_sqlite_db()
-    db = SessionLocal()
+def test_transfer_endpoint_creates_transaction(app_client, app_db):
+    db = app_db()
 
     user = User(phone="+521234000000")
     db.add(user)
@@ -56,16 +38,124 @@ def test_transfer_endpoint_creates_transaction():
     db.add(wallet)
     db.commit()
 
-    client = TestClient(main.app)
-
     payload = {
         "user_id": user.id,
         "amount": 200.0,
         "destination_account": "012345678901234567",
         "client_tx_id": "e2e-1",
     }
-    resp = client.post("/api/v1/transfers", json=payload)
+    resp = app_client.post("/api/v1/transfers", json=payload)
     assert resp.status_code == 200
     data = resp.json()
     assert data["status"] == "completed"
     assert data["amount"] == 200.0
+
+
+def test_routing_session_splits_reads_and_writes(monkeypatch):
+    write_engine = create_engine("sqlite://")
+    read_engine = create_engine("sqlite://")
+    monkeypatch.setattr(main, "engine", write_engine)
+    monkeypatch.setattr(main, "read_engine", read_engine)
+    db = main.RoutingSession()
+
+    assert db.get_bind(clause=select(User)) is read_engine
+    assert db.get_bind(clause=update(User).values(verified=True)) is write_engine
+
+
+def test_split_pools_do_not_deadlock_writer_waiting_on_reader(tmp_path, monkeypatch):
+    db_path = tmp_path / "split.db"
+    write_engine = create_engine(
+        f"sqlite:///{db_path}", pool_size=1, max_overflow=0, pool_timeout=5
+    )
+    main._configure_sqlite_writer(write_engine)
+    Base.metadata.create_all(bind=write_engine)
+    read_engine = create_engine(
+        f"sqlite:///file:{db_path}?mode=ro&uri=true",
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=5,
+    )
+    monkeypatch.setattr(main, "engine", write_engine)
+    monkeypatch.setattr(main, "read_engine", read_engine)
+    SessionLocal = sessionmaker(class_=main.RoutingSession, expire_on_commit=False)
+
+    db = SessionLocal()
+    user = User(phone="+521234000001")
+    db.add(user)
+    db.flush()
+    db.add(Wallet(user_id=user.id, balance=100.0))
+    db.commit()
+    db.close()
+
+    def transfer(i):
+        session = SessionLocal()
+        try:
+            # odd requests look up their client_tx_id on a reader first; even
+            # ones overdraw and need a read after taking the writer
+            bank_client.perform_transfer(
+                session,
+                payer_user_id=user.id,
+                amount=1.0 if i % 2 else 1000.0,
+                destination_account="012345678901234567",
+                client_tx_id=f"split-{i}" if i % 2 else None,
+            )
+        except bank_client.InsufficientFundsError:
+            pass
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(transfer, range(16)))
+
+    write_engine.dispose()
+    read_engine.dispose()
+
+
+def test_sqlite_writer_takes_write_lock_at_begin(tmp_path, monkeypatch):
+    db_path = tmp_path / "split.db"
+    write_engine = create_engine(f"sqlite:///{db_path}", pool_size=1, max_overflow=0)
+    main._configure_sqlite_writer(write_engine)
+    monkeypatch.setattr(main, "engine", write_engine)
+    monkeypatch.setattr(main, "read_engine", create_engine(f"sqlite:///{db_path}"))
+    db = main.RoutingSession()
+
+    # start the write transaction without running any statement yet
+    db.connection(bind_arguments={"clause": update(User).values(verified=True)})
+
+    other = sqlite3.connect(db_path, timeout=0)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="database is locked"):
+            other.execute("BEGIN IMMEDIATE")
+    finally:
+        other.close()
+        db.close()
+    write_engine.dispose()
+
+
+def test_each_request_gets_its_own_session_closed_after_response(
+    app_client, monkeypatch
+):
+    sessions = []
+
+    class RecordingSession(Session):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.closed = False
+            sessions.append(self)
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    monkeypatch.setattr(
+        main, "SessionLocal", sessionmaker(bind=main.engine, class_=RecordingSession)
+    )
+
+    for user_id in ("user-scope-1", "user-scope-2"):
+        resp = app_client.get(f"/api/v1/accounts/{user_id}/balance")
+        assert resp.status_code == 200
+
+    assert len(sessions) == 2
+    assert sessions[0] is not sessions[1]
+    assert all(s.closed for s in sessions)
+    assert not main.ScopedSession.registry.registry
@@ -1,67 +1,15 @@
-import bank_client
-
-
-class DummyResponse:
-    def __init__(self, data, status_code=200):
-        self._data = data
-        self.status_code = status_code
-
-    def raise_for_status(self):
-        if self.status_code >= 400:
-            raise RuntimeError("HTTP error in dummy response")
-
-    def json(self):
-        return self._data
-
+import asyncio
 
-class DummyClient:
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc, tb):
-        return False
-
-    def get(self, url, headers=None):
-        return DummyResponse({"balance": 123.45})
-
-    def post(self, url, headers=None, json=None):
-        data = {
-            "id": "tx-http-1",
-            "payer_wallet_id": "wallet-1",
-            "payee_wallet_id": None,
-            "amount": json.get("amount", 0.0) if json else 0.0,
-            "currency": json.get("currency", "MXN") if json else "MXN",
-            "concept": (
-                json.get("concept", "Transferencia WhatsApp")
-                if json
-                else "Transferencia WhatsApp"
-            ),
-            "status": "completed",
-            "client_tx_id": json.get("client_tx_id") if json else None,
-            "destination_account": json.get("destination_account") if json else None,
-        }
-        return DummyResponse(data)
-
-
-def test_get_balance_http_mode_uses_external_api(monkeypatch):
-    # Configure bank_client for http mode
-    bank_client.BANK_CLIENT_MODE = "http"
-    bank_client.BANK_API_BASE_URL = "https://bank.example.com"
+import bank_client
+from tests.fakes import DummyClient
 
-    monkeypatch.setattr(bank_client, "_get_access_token", lambda: "fake-token")
-    monkeypatch.setattr(bank_client, "_build_http_client", lambda: DummyClient())
 
+def test_get_balance_http_mode_uses_external_api(http_mode_bank):
     balance = bank_client.get_balance(db=None, user_id="user-1")
     assert balance == 123.45
 
 
-def test_perform_transfer_http_mode_returns_tx_like_object(monkeypatch):
-    bank_client.BANK_CLIENT_MODE = "http"
-    bank_client.BANK_API_BASE_URL = "https://bank.example.com"
-
-    monkeypatch.setattr(bank_client, "_get_access_token", lambda: "fake-token")
-    monkeypatch.setattr(bank_client, "_build_http_client", lambda: DummyClient())
-
+def test_perform_transfer_http_mode_returns_tx_like_object(http_mode_bank):
     tx = bank_client.perform_transfer(
         db=None,
         payer_user_id="user-1",
@@ -77,3 +25,42 @@ def test_perform_transfer_http_mode_returns_tx_like_object(monkeypatch):
     assert tx.currency == "MXN"
     assert tx.client_tx_id == "cli-http-1"
     assert tx.destination_account == "012345678901234567"
+
+
+def test_async_perform_transfer_http_mode_uses_async_client(http_mode_bank):
+    tx = asyncio.run(
+        bank_client.aperform_transfer(
+            db=None,
+            payer_user_id="user-1",
+            amount=75.0,
+            destination_account="012345678901234567",
+            client_tx_id="cli-http-async-1",
+        )
+    )
+
+    assert tx.id == "tx-http-1"
+    assert tx.amount == 75.0
+    assert tx.client_tx_id == "cli-http-async-1"
+
+    balance = asyncio.run(bank_client.aget_balance(db=None, user_id="user-1"))
+    assert balance == 123.45
+
+
+def test_access_token_is_cached_until_expiry(monkeypatch):
+    client = DummyClient()
+    monkeypatch.setattr(
+        bank_client, "BANK_API_TOKEN_URL", "https://bank.example.com/token"
+    )
+    monkeypatch.setattr(bank_client, "BANK_API_CLIENT_ID", "client-id")
+    monkeypatch.setattr(bank_client, "BANK_API_CLIENT_SECRET", "client-secret")
+    monkeypatch.setattr(bank_client, "_token_cache", {})
+    monkeypatch.setattr(bank_client, "_get_http_client", lambda: client)
+
+    assert bank_client._get_access_token() == "token-1"
+    assert bank_client._get_access_token() == "token-1"
+    assert client.token_requests == 1
+
+    # new credentials must not reuse the cached token
+    monkeypatch.setattr(bank_client, "BANK_API_CLIENT_ID", "other-client-id")
+    assert bank_client._get_access_token() == "token-1"
+    assert client.token_requests == 2
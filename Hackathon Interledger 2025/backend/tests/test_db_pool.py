@@ -0,0 +1,16 @@
+from db_pool import pool_options
+from sqlalchemy import create_engine
+
+
+def test_memory_sqlite_gets_no_queue_pool_options():
+    for url in ("sqlite://", "sqlite:///:memory:"):
+        assert pool_options(url) == {}
+        create_engine(url, pool_pre_ping=True, **pool_options(url))
+
+
+def test_file_database_gets_queue_pool_options(monkeypatch):
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "7")
+    options = pool_options("sqlite:///./dev.db")
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 10
+    assert options["pool_timeout"] == 7
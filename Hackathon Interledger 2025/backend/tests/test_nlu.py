@@ -14,6 +14,81 @@ def test_transferir_intent_with_entities():
     assert result["entities"]["destination_account"] == "012345678901234567"
 
 
+def test_transfer_account_before_amount_is_not_taken_as_amount():
+    result = nlu.parse_text("enviar a 012345678901234567 la cantidad de 99,5")
+    assert result["entities"] == {
+        "amount": 99.5,
+        "destination_account": "012345678901234567",
+    }
+
+
+def test_digit_runs_longer_than_an_account_are_rejected():
+    for text in (
+        "enviar a 0123456789012345678901234",
+        "transferir a 0123456789012345678901",
+    ):
+        assert nlu.parse_text(text)["entities"] == {}
+
+
+def test_saldo_takes_precedence_over_transfer_keywords():
+    result = nlu.parse_text("Antes de enviar dinero dime mi saldo")
+    assert result["intent"]["name"] == nlu.INTENT_CONSULTAR_SALDO
+
+
 def test_desconocido_intent():
     result = nlu.parse_text("Texto que no tiene sentido financiero")
     assert result["intent"]["name"] == nlu.INTENT_DESCONOCIDO
+
+
+def test_remote_provider_results_are_cached(monkeypatch):
+    calls = []
+
+    def fake_rasa(text):
+        calls.append(text)
+        return {
+            "intent": {"name": nlu.INTENT_CONSULTAR_SALDO, "confidence": 0.99},
+            "entities": {},
+            "text": text,
+        }
+
+    monkeypatch.setattr(nlu, "NLU_PROVIDER", "rasa")
+    monkeypatch.setattr(nlu, "_parse_rasa", fake_rasa)
+    nlu._parse_cache.clear()
+
+    first = nlu.parse_text("Saldo")
+    second = nlu.parse_text("  saldo ")
+
+    assert len(calls) == 1
+    assert first["intent"] == second["intent"]
+    assert second["text"] == "  saldo "
+
+
+def test_openai_non_json_reply_falls_back_without_caching(monkeypatch):
+    calls = []
+
+    class FakeResponse:
+        content = b'{"choices": [{"message": {"content": "no es JSON"}}]}'
+
+        def raise_for_status(self):
+            pass
+
+    def fake_post(url, **kwargs):
+        calls.append(url)
+        return FakeResponse()
+
+    def rasa_down(text):
+        raise RuntimeError("rasa unavailable")
+
+    monkeypatch.setenv("NLU_OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(nlu, "NLU_PROVIDER", "openai")
+    monkeypatch.setattr(nlu.httpx, "post", fake_post)
+    monkeypatch.setattr(nlu, "_parse_rasa", rasa_down)
+    nlu._parse_cache.clear()
+
+    first = nlu.parse_text("Saldo")
+    second = nlu.parse_text("Saldo")
+
+    assert len(calls) == 2
+    assert first["intent"]["name"] == nlu.INTENT_CONSULTAR_SALDO
+    assert second["intent"]["name"] == nlu.INTENT_CONSULTAR_SALDO
+    assert not nlu._parse_cache
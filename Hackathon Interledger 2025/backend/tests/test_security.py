@@ -1,18 +1,8 @@
 import main
 import pytest
+import redis
 from fastapi import HTTPException
-from models import Base, User
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-
-def setup_in_memory_db():
-    engine = create_engine(
-        "sqlite:///:memory:", connect_args={"check_same_thread": False}
-    )
-    Base.metadata.create_all(bind=engine)
-    SessionLocal = sessionmaker(bind=engine)
-    return SessionLocal
+from models import User, VerifyLog
 
 
 def test_rate_limit_exceeded_raises_http_exception():
@@ -30,28 +20,67 @@ def test_rate_limit_exceeded_raises_http_exception():
     assert exc.value.status_code == 429
 
 
-def test_otp_lock_and_reset():
-    SessionLocal = setup_in_memory_db()
-    db = SessionLocal()
+def test_rate_limit_falls_back_to_local_store_when_redis_fails(monkeypatch):
+    main._rate_limit_store.clear()
+
+    def unavailable(keys, args):
+        raise redis.ConnectionError("connection refused")
+
+    monkeypatch.setattr(main, "_rate_limit_script", unavailable)
+
+    main._check_rate_limit("test-redis-down", 1)
+    with pytest.raises(HTTPException) as exc:
+        main._check_rate_limit("test-redis-down", 1)
+    assert exc.value.status_code == 429
+
+
+def test_rate_limit_counts_part_of_previous_window(monkeypatch):
+    main._rate_limit_store.clear()
+    now = [600.0]
+    monkeypatch.setattr(main, "monotonic", lambda: now[0])
+    key = "test-sliding"
+    limit = 4
+
+    for _ in range(limit):
+        main._check_rate_limit(key, limit)
+
+    # halfway through the next window, half of the previous 4 still count
+    now[0] = 690.0
+    main._check_rate_limit(key, limit)
+    main._check_rate_limit(key, limit)
+    with pytest.raises(HTTPException) as exc:
+        main._check_rate_limit(key, limit)
+    assert exc.value.status_code == 429
+
+
+def test_rate_limit_store_evicts_least_recently_used_keys(monkeypatch):
+    main._rate_limit_store.clear()
+    monkeypatch.setattr(main, "RATE_LIMIT_MAX_KEYS", 2)
+
+    main._check_rate_limit("key-a", 5)
+    main._check_rate_limit("key-b", 5)
+    main._check_rate_limit("key-a", 5)
+    main._check_rate_limit("key-c", 5)
+
+    assert list(main._rate_limit_store) == ["key-a", "key-c"]
 
+
+def test_otp_lock_and_reset(db):
     user = User(phone="+521234567800")
     db.add(user)
     db.commit()
-    db.refresh(user)
 
     # make the thresholds small for the test
     main.OTP_MAX_ATTEMPTS = 2
     main.OTP_LOCK_MINUTES = 1
 
     # first failed attempt: should increment counter but not lock yet
-    main._register_otp_result(db, user, status_val="denied")
-    db.refresh(user)
+    user = main._register_otp_result(db, user, status_val="denied")
     assert user.otp_failed_attempts == 1
     assert user.otp_locked_until is None
 
     # second failed attempt: should lock the user
-    main._register_otp_result(db, user, status_val="denied")
-    db.refresh(user)
+    user = main._register_otp_result(db, user, status_val="denied")
     assert user.otp_failed_attempts == 2
     assert user.otp_locked_until is not None
 
@@ -60,8 +89,23 @@ def test_otp_lock_and_reset():
     assert exc.value.status_code == 423
 
     # approved OTP should reset counters and lock
-    main._register_otp_result(db, user, status_val="approved")
-    db.refresh(user)
+    user = main._register_otp_result(db, user, status_val="approved")
     assert user.otp_failed_attempts == 0
     assert user.otp_locked_until is None
     assert user.verified is True
+
+
+def test_verify_otp_logs_attempt_and_counts_failure(db, monkeypatch):
+    class FakeCheck:
+        sid = "VE123"
+        channel = "whatsapp"
+        status = "pending"
+
+    monkeypatch.setattr(main, "check_verification", lambda phone, code: FakeCheck())
+
+    status_val = main._verify_otp(db, "+521234567801", "123456")
+
+    assert status_val == "pending"
+    user = db.query(User).filter(User.phone == "+521234567801").one()
+    assert user.otp_failed_attempts == 1
+    assert db.query(VerifyLog).filter(VerifyLog.verify_sid == "VE123").count() == 1
@@ -1,24 +1,40 @@
+import logging
 import re
 
-import main
-import responses
-from fastapi.testclient import TestClient
+import orjson
+import pytest
+import twilio_client
+from twilio.http import HttpClient
+from twilio.http.response import Response
 
+_TWILIO_VERIFY_RE = re.compile(
+    r"https://verify\.twilio\.com/v2/Services/[^/]+/Verifications\Z"
+)
 
-@responses.activate
-def test_verify_send_uses_twilio_verify_api():
-    # Mock Twilio Verify endpoint
-    pattern = re.compile(r"https://verify\.twilio\.com/v2/Services/.*/Verifications")
-    responses.add(
-        responses.POST,
-        pattern,
-        json={"sid": "VEXXXXXXXXXXXXXXXXXXXXXXXXXXXX", "status": "pending"},
-        status=201,
+
+class FakeTwilioHttpClient(HttpClient):
+    """Answers Twilio API calls in-process instead of over HTTP."""
+
+    def __init__(self):
+        super().__init__(logging.getLogger(__name__), is_async=False)
+
+    def request(self, method, uri, params=None, data=None, headers=None, **kwargs):
+        # Mock Twilio Verify endpoint
+        if method == "POST" and _TWILIO_VERIFY_RE.match(uri):
+            body = {"sid": "VEXXXXXXXXXXXXXXXXXXXXXXXXXXXX", "status": "pending"}
+            return Response(201, orjson.dumps(body).decode())
+        return Response(404, "{}")
+
+
+@pytest.fixture
+def fake_twilio(monkeypatch):
+    monkeypatch.setattr(
+        twilio_client.twilio_client, "http_client", FakeTwilioHttpClient()
     )
 
-    client = TestClient(main.app)
 
-    resp = client.post(
+def test_verify_send_uses_twilio_verify_api(app_client, fake_twilio):
+    resp = app_client.post(
         "/api/v1/verify/send",
         json={"phone": "+521234567890"},
     )
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import phonenumbers
 from twilio.request_validator import RequestValidator
 import os
@@ -6,6 +8,10 @@ from fastapi import HTTPException
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 validator = RequestValidator(TWILIO_AUTH_TOKEN)
 
+# Pure function called on every webhook/API request for a small set of
+# recurring numbers; memoize it so phonenumbers only parses each once.
+# Invalid numbers raise and are therefore never cached.
+@lru_cache(maxsize=4096)
 def to_e164(number: str, region="MX"):
     try:
         p = phonenumbers.parse(number, region)
@@ -0,0 +1,40 @@
+"""arq worker for the WhatsApp webhook's follow-up tasks.
+
+With TASK_QUEUE=arq the webhook enqueues Lookup/Verify and the execution
+of approved requests in Redis instead of running them in the web
+process. Start one or more workers with:
+
+  arq worker.WorkerSettings
+
+Reads REDIS_URL (and the same DATABASE_URL/Twilio/bank settings as the
+app) from the environment.
+"""
+
+import asyncio
+import os
+
+from arq.connections import RedisSettings
+
+import main
+
+REDIS_URL = os.getenv("REDIS_URL")
+if not REDIS_URL:
+    raise RuntimeError("TASK_QUEUE=arq requires REDIS_URL")
+
+
+async def process_lookup_and_verify(ctx, phone, user_id, pending_id):
+    await asyncio.to_thread(main.process_lookup_and_verify, phone, user_id, pending_id)
+
+
+async def execute_pending_request(ctx, pending_id):
+    await asyncio.to_thread(main.execute_pending_request, pending_id)
+
+
+async def startup(ctx):
+    main.configure_logging()
+
+
+class WorkerSettings:
+    functions = [process_lookup_and_verify, execute_pending_request]
+    on_startup = startup
+    redis_settings = RedisSettings.from_dsn(REDIS_URL)